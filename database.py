@@ -5,51 +5,96 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
-_client = None
-db = None
-
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+def connect_db():
+    """Open a Motor client (from the app lifespan) and return its database handle, or None"""
+    if not (database_url and database_name):
+        return None
+    client = AsyncIOMotorClient(database_url, maxPoolSize=100, minPoolSize=10)
+    return client[database_name]
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+def close_db(database):
+    """Close the client behind a database handle"""
+    if database is not None:
+        database.client.close()
 
+# Helper functions for common database operations
+async def insert_document(database, collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document stamped with the server's clock and return it as stored"""
     # Convert Pydantic model to dict if needed
     if isinstance(data, BaseModel):
         data_dict = data.model_dump()
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    if data_dict.get('_id') is not None:
+        # A caller-chosen _id could match an existing document, so insert it plainly:
+        # a clash raises DuplicateKeyError instead of merging into that document
+        data_dict['created_at'] = datetime.now(timezone.utc)
+        data_dict['updated_at'] = datetime.now(timezone.utc)
+        await database[collection_name].insert_one(data_dict)
+        return data_dict
+
+    # Timestamps come from $currentDate; also setting them would conflict
+    data_dict.pop('_id', None)
+    data_dict.pop('created_at', None)
+    data_dict.pop('updated_at', None)
 
-    result = db[collection_name].insert_one(data_dict)
-    return str(result.inserted_id)
+    # Upserting on a fresh _id always inserts, so $currentDate can stamp the timestamps
+    # and the stored document comes back in the same round-trip
+    return await database[collection_name].find_one_and_update(
+        {'_id': ObjectId()},
+        {'$setOnInsert': data_dict, '$currentDate': {'created_at': True, 'updated_at': True}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_document(database, collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    doc = await insert_document(database, collection_name, data)
+    return str(doc['_id'])
+
+async def create_documents(database, collection_name: str, items: List[Union[BaseModel, dict]]):
+    """Insert many documents with timestamps in a single round-trip"""
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    if not docs:
+        return []
+    # ordered=False lets the server continue past individual failures; the driver then
+    # raises BulkWriteError, so report the documents that did make it in
+    try:
+        result = await database[collection_name].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {err['index'] for err in e.details.get('writeErrors', [])}
+        return [str(d['_id']) for i, d in enumerate(docs) if i not in failed]
+    return [str(i) for i in result.inserted_ids]
+
+async def get_documents(database, collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = database[collection_name].find(filter_dict or {})
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return await cursor.to_list(length=None)
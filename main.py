@@ -1,14 +1,111 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+import hashlib
+import hmac
+import secrets
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, TypeAdapter
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+from bson.codec_options import TypeDecoder, TypeRegistry
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from cachetools import TTLCache
+import orjson
+import bcrypt
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
 
-from database import db, create_document, get_documents
-from schemas import User, Movie, ListItem
+from database import connect_db, close_db, create_documents, insert_document
+from schemas import OBJECT_ID_RE, Movie, PyObjectId
 
-app = FastAPI(title="Netflix Clone API")
+logger = logging.getLogger(__name__)
+
+async def create_unique_index(collection, keys):
+    """Create a unique index, logging (not raising) if existing duplicates block it"""
+    try:
+        await collection.create_index(keys, unique=True)
+    except OperationFailure as e:
+        # Older check-then-insert code could leave duplicates; don't refuse to boot over them
+        logger.error("Could not create unique index %s on %s; remove the duplicates: %s", keys, collection.name, e)
+
+async def ensure_indexes(db):
+    """Create indexes backing every query predicate used by the API"""
+    await create_unique_index(db["user"], "email")
+    await db["session"].create_index("token_hash", unique=True)
+    # TTL index: Mongo drops sessions once expires_at has passed
+    await db["session"].create_index("expires_at", expireAfterSeconds=0)
+    # Also serves user_id-only lookups via its prefix
+    await create_unique_index(db["listitem"], [("user_id", 1), ("movie_id", 1)])
+    await db["movie"].create_index([("genres", 1), ("featured", 1)])
+    await db["movie"].create_index("featured")
+
+def _to_object_id_or_keep(field: str) -> dict:
+    # Older rows may hold arbitrary strings; leave those as-is instead of failing the update
+    return {"$convert": {"input": field, "to": "objectId", "onError": field, "onNull": field}}
+
+async def migrate_list_items(db):
+    """Convert list items written with string ids to native ObjectIds (idempotent)"""
+    result = await db["listitem"].update_many(
+        {"user_id": {"$type": "string"}},
+        [{"$set": {"user_id": _to_object_id_or_keep("$user_id"), "movie_id": _to_object_id_or_keep("$movie_id")}}],
+    )
+    if result.modified_count:
+        logger.info("Converted %d list items to ObjectId references", result.modified_count)
+
+def _orjson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+class MongoJSONResponse(ORJSONResponse):
+    """orjson response that also encodes BSON ObjectIds"""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open and warm the Motor pool before accepting traffic rather than on first request
+    db = connect_db()
+    if db is not None:
+        await db.client.admin.command("ping")
+        await ensure_indexes(db)
+        await migrate_list_items(db)
+        await db["movie"].find_one({"_id": 0})
+    app.state.db = db
+    yield
+    app.state.db = None
+    close_db(db)
+
+def get_optional_db(request: Request):
+    """Dependency: the database handle opened by the lifespan, or None if unconfigured"""
+    return getattr(request.app.state, "db", None)
+
+def get_db(db=Depends(get_optional_db)):
+    """Dependency: the database handle opened by the lifespan"""
+    if db is None:
+        raise HTTPException(503, "Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    return db
+
+app = FastAPI(title="Netflix Clone API", lifespan=lifespan, default_response_class=MongoJSONResponse)
+
+# Throttles bcrypt-heavy endpoints so password checks can't be used to burn CPU.
+# The default memory:// storage is per worker, so with N workers the effective limit
+# is N times the configured one; point RATE_LIMIT_STORAGE_URI at a shared backend
+# (e.g. redis://host:6379, needs the redis package) to enforce it across workers.
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=os.getenv("RATE_LIMIT_STORAGE_URI", "memory://"),
+)
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,37 +117,152 @@ app.add_middleware(
 
 # Utilities
 
+# Per-process cache for the read-heavy catalog endpoints; cleared on catalog writes
+movie_cache = TTLCache(maxsize=1024, ttl=30)
+# Bumped on every catalog write so reads that started earlier don't re-cache stale data
+movie_cache_generation = 0
+# List bodies larger than this are streamed but not cached, keeping per-request memory bounded
+MOVIE_CACHE_MAX_BYTES = 512 * 1024
+
+def invalidate_movie_cache():
+    global movie_cache_generation
+    movie_cache_generation += 1
+    movie_cache.clear()
+
+# Fields a catalog grid/card needs; the full document is served by get_movie
+MOVIE_CARD_FIELDS = ("title", "thumbnail_url", "featured", "genres", "rating", "year")
+MOVIE_FIELDS = frozenset(Movie.model_fields)
+
+def movie_projection(fields: Optional[str] = None) -> dict:
+    """Resolve a comma-separated field list into a Mongo projection"""
+    names = [f.strip() for f in fields.split(",") if f.strip()] if fields else MOVIE_CARD_FIELDS
+    unknown = [f for f in names if f not in MOVIE_FIELDS]
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}")
+    return {"_id": 1, **{f: 1 for f in names}}
+
+class _ObjectIdAsStr(TypeDecoder):
+    """Decode ObjectIds straight to hex strings while parsing BSON"""
+    bson_type = ObjectId
+
+    def transform_bson(self, value):
+        return str(value)
+
+_STR_ID_REGISTRY = TypeRegistry([_ObjectIdAsStr()])
+
+def str_id_view(collection):
+    """Collection view whose reads return string ids; only for docs whose sole ObjectId is _id"""
+    return collection.with_options(
+        codec_options=collection.codec_options.with_options(type_registry=_STR_ID_REGISTRY)
+    )
+
 def to_str_id(doc):
+    # Driver documents are fresh dicts, so rename _id in place rather than copying;
+    # str() is a no-op for ids already decoded by str_id_view
     if not doc:
         return doc
-    d = dict(doc)
-    if "_id" in d:
-        d["id"] = str(d.pop("_id"))
-    return d
+    if "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    return doc
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    if not stored:
+        return False
+    if stored.startswith("$2"):
+        return bcrypt.checkpw(password.encode(), stored.encode())
+    # Accounts created before hashing was introduced stored the plaintext password
+    return hmac.compare_digest(password.encode(), stored.encode())
+
+# Checked against when the email is unknown so both failure paths cost the same
+_DUMMY_HASH = hash_password(secrets.token_urlsafe(16))
+
+def oid_param(movie_id: str) -> ObjectId:
+    """Path dependency: reject malformed ids with a regex instead of catching ObjectId errors"""
+    if not OBJECT_ID_RE.fullmatch(movie_id):
+        raise HTTPException(400, "Invalid id")
+    return ObjectId(movie_id)
+
+SESSION_LIFETIME = timedelta(days=30)
+
+# Per-process token_hash -> user_id cache so repeat requests skip the session read.
+# Entries outlive a logout on other workers by at most the TTL.
+session_cache = TTLCache(maxsize=10_000, ttl=60)
 
-# Auth models (simplified demo — token = email for now)
+def hash_token(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+async def create_session(db, user_id: ObjectId) -> str:
+    """Issue a new bearer token for the user and store only its hash"""
+    token = secrets.token_urlsafe(32)
+    await db["session"].insert_one({
+        "token_hash": hash_token(token),
+        "user_id": user_id,
+        "expires_at": datetime.now(timezone.utc) + SESSION_LIFETIME,
+    })
+    return token
+
+async def resolve_user_id(db, token: str) -> ObjectId:
+    """Return the user _id owning a token, or raise 401"""
+    token_hash = hash_token(token)
+    user_id = session_cache.get(token_hash)
+    if user_id is not None:
+        return user_id
+    session = await db["session"].find_one(
+        {"token_hash": token_hash, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "user_id": 1},
+    )
+    if not session:
+        raise HTTPException(401, "Invalid token")
+    session_cache[token_hash] = session["user_id"]
+    return session["user_id"]
+
+# Auth models (simplified demo — opaque random bearer tokens)
 class RegisterRequest(BaseModel):
     name: str
-    email: str
+    email: EmailStr
     password: str
 
 class LoginRequest(BaseModel):
     email: str
     password: str
 
+class LogoutRequest(BaseModel):
+    token: str
+
+class UserOut(BaseModel):
+    """Public user fields; validates straight from a Mongo doc and drops credentials"""
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    id: PyObjectId = Field(..., alias="_id")
+    name: str
+    email: str
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
 class AuthResponse(BaseModel):
     token: str
-    user: dict
+    user: UserOut
+
+# Built once at import so each request reuses the compiled serializer
+AUTH_TA = TypeAdapter(AuthResponse)
+
+def auth_response(token: str, user: dict):
+    return MongoJSONResponse(AUTH_TA.dump_python(AuthResponse(token=token, user=user), mode="json"))
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Netflix Clone Backend Running"}
 
 @app.get("/test")
-def test_database():
+async def test_database(db=Depends(get_optional_db)):
     response = {"backend": "✅ Running", "database": "❌ Not Available", "collections": []}
+    if db is None:
+        return response
     try:
-        collections = db.list_collection_names()
+        collections = await db.list_collection_names()
         response["database"] = "✅ Connected"
         response["collections"] = collections
     except Exception as e:
@@ -59,74 +271,153 @@ def test_database():
 
 # Auth endpoints (very basic for demo)
 @app.post("/api/auth/register", response_model=AuthResponse)
-def register(payload: RegisterRequest):
-    existing = db["user"].find_one({"email": payload.email})
-    if existing:
+@limiter.limit("10/minute")
+async def register(request: Request, payload: RegisterRequest, db=Depends(get_db)):
+    password_hash = await run_in_threadpool(hash_password, payload.password)
+    # RegisterRequest is already validated, so build the "user" document directly
+    user = {"name": payload.name, "email": payload.email, "password_hash": password_hash}
+    # The unique email index rejects duplicates, including concurrent registrations
+    try:
+        user = await insert_document(db, "user", user)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = User(
-        name=payload.name,
-        email=payload.email,
-        password_hash=payload.password,  # demo only
-    )
-    user_id = create_document("user", user)
-    token = payload.email  # demo token
-    db["user"].update_one({"_id": ObjectId(user_id)}, {"$push": {"tokens": token}})
-    created = db["user"].find_one({"_id": ObjectId(user_id)})
-    return AuthResponse(token=token, user=to_str_id(created))
+    token = await create_session(db, user["_id"])
+    return auth_response(token, user)
 
 @app.post("/api/auth/login", response_model=AuthResponse)
-def login(payload: LoginRequest):
-    user = db["user"].find_one({"email": payload.email})
-    if not user or user.get("password_hash") != payload.password:
+@limiter.limit("10/minute")
+async def login(request: Request, payload: LoginRequest, db=Depends(get_db)):
+    # Accounts from before sessions may still carry a token array; never ship it
+    user = await db["user"].find_one({"email": payload.email}, projection={"tokens": 0})
+    stored = user.get("password_hash") if user else _DUMMY_HASH
+    # bcrypt is deliberately slow; keep it off the event loop
+    valid = await run_in_threadpool(verify_password, payload.password, stored)
+    if not user or not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = payload.email
-    db["user"].update_one({"_id": user["_id"]}, {"$addToSet": {"tokens": token}})
-    return AuthResponse(token=token, user=to_str_id(user))
+    if stored.startswith("$2"):
+        token = await create_session(db, user["_id"])
+    else:
+        # Upgrade a legacy plaintext password to a bcrypt hash on successful login
+        password_hash = await run_in_threadpool(hash_password, payload.password)
+        token, _ = await asyncio.gather(
+            create_session(db, user["_id"]),
+            db["user"].update_one(
+                {"_id": user["_id"]},
+                {
+                    "$set": {"password_hash": password_hash},
+                    "$unset": {"tokens": ""},
+                    "$currentDate": {"updated_at": True},
+                },
+            ),
+        )
+    return auth_response(token, user)
+
+@app.post("/api/auth/logout")
+async def logout(payload: LogoutRequest, db=Depends(get_db)):
+    token_hash = hash_token(payload.token)
+    session_cache.pop(token_hash, None)
+    await db["session"].delete_one({"token_hash": token_hash})
+    return {"message": "Logged out"}
 
 # Movies
-class MovieCreate(BaseModel):
-    title: str
-    description: Optional[str] = None
-    year: Optional[int] = None
-    genres: List[str] = []
-    rating: Optional[float] = None
-    duration_minutes: Optional[int] = None
-    thumbnail_url: Optional[str] = None
-    video_url: Optional[str] = None
-    featured: bool = False
+class MovieCreate(Movie):
+    """Request body for creating a movie (validated against the Movie schema)"""
+
+class MovieOut(Movie):
+    """Full movie document as returned by the API"""
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    id: PyObjectId = Field(..., alias="_id")
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+MOVIE_TA = TypeAdapter(MovieOut)
+
+def movie_out(doc: dict) -> dict:
+    """Serialize a stored movie the same way for every endpoint returning one"""
+    # Not re-validated: rows written out-of-band may not satisfy Movie's constraints and
+    # should still be returned. A str _id from str_id_view passes through untouched.
+    return MOVIE_TA.dump_python(MovieOut.model_construct(**doc), mode="json")
 
 @app.post("/api/movies")
-def create_movie(movie: MovieCreate):
-    movie_model = Movie(**movie.model_dump())
-    new_id = create_document("movie", movie_model)
-    created = db["movie"].find_one({"_id": ObjectId(new_id)})
-    return to_str_id(created)
+async def create_movie(movie: MovieCreate, db=Depends(get_db)):
+    # FastAPI already validated the body, so insert it as-is; no separate re-read
+    doc = await insert_document(db, "movie", movie)
+    invalidate_movie_cache()
+    return MongoJSONResponse(movie_out(doc))
 
 @app.get("/api/movies")
-def list_movies(genre: Optional[str] = None, featured: Optional[bool] = None):
+async def list_movies(
+    genre: Optional[str] = None,
+    featured: Optional[bool] = None,
+    fields: Optional[str] = None,
+    db=Depends(get_db),
+):
+    projection = movie_projection(fields)
+    key = ("list", genre, featured, tuple(projection))
+    cached = movie_cache.get(key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
     q = {}
     if genre:
         q["genres"] = genre
     if featured is not None:
         q["featured"] = featured
-    items = get_documents("movie", q)
-    return [to_str_id(i) for i in items]
+    cursor = str_id_view(db["movie"]).find(q, projection=projection, batch_size=200)
+    generation = movie_cache_generation
+
+    async def stream():
+        # Encode documents as the cursor yields them instead of materializing the list.
+        # Small bodies are also kept for the cache, written only once the stream completes.
+        chunks, size = [b"["], 1
+        first = True
+        yield b"["
+        try:
+            async for doc in cursor:
+                chunk = orjson.dumps(to_str_id(doc), default=_orjson_default)
+                if not first:
+                    chunk = b"," + chunk
+                first = False
+                if chunks is not None:
+                    size += len(chunk)
+                    if size <= MOVIE_CACHE_MAX_BYTES:
+                        chunks.append(chunk)
+                    else:
+                        chunks = None
+                yield chunk
+        except Exception:
+            # The 200 status is already sent, so the client only sees truncated JSON
+            logger.exception("Movie list stream failed after the response started")
+            raise
+        finally:
+            # Release the server-side cursor on errors and client disconnects too
+            await cursor.close()
+        yield b"]"
+        if chunks is not None and generation == movie_cache_generation:
+            chunks.append(b"]")
+            movie_cache[key] = b"".join(chunks)
+
+    return StreamingResponse(stream(), media_type="application/json")
 
 @app.get("/api/movies/{movie_id}")
-def get_movie(movie_id: str):
-    try:
-        oid = ObjectId(movie_id)
-    except Exception:
-        raise HTTPException(400, "Invalid id")
-    m = db["movie"].find_one({"_id": oid})
+async def get_movie(oid: ObjectId = Depends(oid_param), db=Depends(get_db)):
+    key = ("detail", oid)
+    cached = movie_cache.get(key)
+    if cached is not None:
+        return MongoJSONResponse(cached)
+    generation = movie_cache_generation
+    m = await str_id_view(db["movie"]).find_one({"_id": oid})
     if not m:
         raise HTTPException(404, "Movie not found")
-    return to_str_id(m)
+    result = movie_out(m)
+    if generation == movie_cache_generation:
+        movie_cache[key] = result
+    return MongoJSONResponse(result)
 
 # Seed demo catalog
 @app.post("/api/seed")
-def seed_demo_movies():
-    count = db["movie"].count_documents({})
+async def seed_demo_movies(db=Depends(get_db)):
+    count = await db["movie"].count_documents({})
     if count > 0:
         return {"message": "Catalog already seeded", "count": count}
     demo_thumb = "https://images.unsplash.com/photo-1524985069026-dd778a71c7b4?w=800&q=80&auto=format&fit=crop"
@@ -138,42 +429,63 @@ def seed_demo_movies():
         {"title": "Planet Blue", "description": "Nature docu-series pilot.", "year": 2020, "genres": ["Documentary"], "rating": 8.7, "duration_minutes": 50, "thumbnail_url": demo_thumb, "video_url": demo_video},
         {"title": "Shadow School", "description": "Teens with secret powers.", "year": 2024, "genres": ["Drama", "Fantasy"], "rating": 7.9, "duration_minutes": 45, "thumbnail_url": demo_thumb, "video_url": demo_video}
     ]
-    inserted = 0
-    for d in demos:
-        mid = create_document("movie", Movie(**d))
-        if mid:
-            inserted += 1
-    return {"message": "Seeded", "inserted": inserted}
+    ids = await create_documents(db, "movie", [Movie(**d) for d in demos])
+    invalidate_movie_cache()
+    return {"message": "Seeded", "inserted": len(ids)}
 
 # My List
 class ListRequest(BaseModel):
     token: str  # demo auth
-    movie_id: str
+    movie_id: PyObjectId
 
 @app.post("/api/list/add")
-def add_to_list(payload: ListRequest):
-    user = db["user"].find_one({"tokens": payload.token})
-    if not user:
-        raise HTTPException(401, "Invalid token")
-    existing = db["listitem"].find_one({"user_id": str(user["_id"]), "movie_id": payload.movie_id})
-    if existing:
-        return to_str_id(existing)
-    item = ListItem(user_id=str(user["_id"]), movie_id=payload.movie_id)
-    item_id = create_document("listitem", item)
-    created = db["listitem"].find_one({"_id": ObjectId(item_id)})
-    return to_str_id(created)
+async def add_to_list(payload: ListRequest, db=Depends(get_db)):
+    user_id = await resolve_user_id(db, payload.token)
+    # Single round-trip: insert if missing, otherwise return the existing item.
+    # The pipeline update only fills timestamps (from the server clock) on insert.
+    created = await db["listitem"].find_one_and_update(
+        {"user_id": user_id, "movie_id": payload.movie_id},
+        [{"$set": {
+            "created_at": {"$ifNull": ["$created_at", "$$NOW"]},
+            "updated_at": {"$ifNull": ["$updated_at", "$$NOW"]},
+        }}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    # Rendered directly so the orjson hook encodes the ObjectId fields
+    return MongoJSONResponse(to_str_id(created))
 
 @app.get("/api/list")
-def get_list(token: str):
-    user = db["user"].find_one({"tokens": token})
-    if not user:
-        raise HTTPException(401, "Invalid token")
-    items = list(db["listitem"].find({"user_id": str(user["_id"])}))
-    movie_ids = [ObjectId(i["movie_id"]) for i in items]
-    movies = list(db["movie"].find({"_id": {"$in": movie_ids}})) if movie_ids else []
+async def get_list(token: str, db=Depends(get_db)):
+    user_id = await resolve_user_id(db, token)
+    # $match first so only this user's items (index-backed) get joined
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$lookup": {
+            "from": "movie",
+            "localField": "movie_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": movie_projection()}],
+            "as": "movie",
+        }},
+        {"$unwind": "$movie"},
+        {"$replaceRoot": {"newRoot": "$movie"}},
+    ]
+    # The pipeline's output is movie documents, so string-decoding ids is safe here
+    movies = await str_id_view(db["listitem"]).aggregate(pipeline).to_list(length=None)
     return [to_str_id(m) for m in movies]
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # One worker per core (2*CPU+1) to get past the GIL; caches above stay per-worker
+    workers = int(os.getenv("WEB_CONCURRENCY", max(2, (os.cpu_count() or 1) * 2 + 1)))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        proxy_headers=True,
+    )
@@ -9,11 +9,32 @@ Model name is converted to lowercase for the collection name:
 - User -> "user" collection
 - Movie -> "movie" collection
 - ListItem -> "listitem" collection
+- Session -> "session" collection
 """
 
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
+import re
+from pydantic import BaseModel, Field, EmailStr, PlainSerializer, PlainValidator, WithJsonSchema
+from typing import Annotated, Optional, List
 from datetime import datetime
+from bson import ObjectId
+
+# 24 hex chars; checked up front so bad ids never reach ObjectId's exception path
+OBJECT_ID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
+def _validate_object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and OBJECT_ID_RE.fullmatch(value):
+        return ObjectId(value)
+    raise ValueError("Invalid ObjectId")
+
+# Native BSON ObjectId that accepts/serializes as a 24-char hex string at the API edge
+PyObjectId = Annotated[
+    ObjectId,
+    PlainValidator(_validate_object_id),
+    PlainSerializer(str, when_used="json"),
+    WithJsonSchema({"type": "string"}),
+]
 
 class User(BaseModel):
     """
@@ -25,7 +46,6 @@ class User(BaseModel):
     password_hash: str = Field(..., description="Password hash")
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
-    tokens: Optional[List[str]] = Field(default_factory=list, description="Auth tokens")
 
 class Movie(BaseModel):
     """
@@ -47,7 +67,16 @@ class ListItem(BaseModel):
     User saved list items
     Collection name: "listitem"
     """
-    user_id: str = Field(..., description="User _id as string")
-    movie_id: str = Field(..., description="Movie _id as string")
+    user_id: PyObjectId = Field(..., description="User _id")
+    movie_id: PyObjectId = Field(..., description="Movie _id")
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+
+class Session(BaseModel):
+    """
+    Auth sessions (expired automatically by a TTL index on expires_at)
+    Collection name: "session"
+    """
+    token_hash: bytes = Field(..., description="SHA-256 digest of the bearer token")
+    user_id: PyObjectId = Field(..., description="User _id")
+    expires_at: datetime = Field(..., description="When the session stops being valid")